@@ -4,15 +4,15 @@ from main import LOGO_COLOUR_MODE
 
 WHITE = (255, 255, 255)
 ORIGINAL_FILE = "cropped-Das-25-BW-Pink-Splash.png"
+BW_LUT = [0] * 255 + [255]  # anything below pure white becomes black
 
 
 def main():
     logo = Image.open(ORIGINAL_FILE).convert(LOGO_COLOUR_MODE)
-    r, g, b, a = logo.split()
-    rgb_logo = Image.merge("RGB", (r, g, b))
-    bw_logo = rgb_logo.convert("L").point(lambda p: 0 if p < 255 else 255, mode='1')
+    alpha = logo.getchannel("A")
+    bw_logo = logo.convert("L").point(BW_LUT, mode='1')
     final_logo = Image.new("RGB", bw_logo.size, "white")
-    final_logo.paste(bw_logo, mask=logo.split()[3])
+    final_logo.paste(bw_logo, mask=alpha)
     final_logo.save("logo_bw.png")
 
 
@@ -1,8 +1,13 @@
+import functools
+import multiprocessing
 import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageFont
 from brother_ql import create_label
 from brother_ql.backends import guess_backend, backend_factory
 from brother_ql.conversion import convert
@@ -16,10 +21,16 @@ PREVIEW_METHOD = "pil"  # Options: "pil" (basic), "matplotlib" (grid view)
 SAVE_PREVIEWS = False  # Set to True to also save preview images to files
 PREVIEW_SAVE_PATH = "label_previews"  # Folder to save preview images if SAVE_PREVIEWS is True
 PREVIEW_COLUMNS = 10
+PREVIEW_DOWNSCALE = 2  # Grid tiles are shown far below label DPI anyway
 
 # Font settings
-LARGE_FONT = ImageFont.truetype("Inter-Bold.ttf", 75) # Name
-SMALL_FONT = ImageFont.truetype("Inter-Regular.ttf", 50) # Category and t-shirt size
+# Basic layout skips HarfBuzz shaping, which short Latin names don't need.
+FONT_LAYOUT = ImageFont.Layout.BASIC
+LARGE_FONT = ImageFont.truetype("Inter-Bold.ttf", 75, layout_engine=FONT_LAYOUT) # Name
+SMALL_FONT = ImageFont.truetype(
+    "Inter-Regular.ttf", 50, layout_engine=FONT_LAYOUT) # Category and t-shirt size
+FONTS = {"large": LARGE_FONT, "small": SMALL_FONT}
+TEXT_TILE_CACHE_SIZE = 512
 
 # Constants for layout
 LABEL_SIZE = (991, 413)  # 38x90mm die-cut label, rotated to landscape
@@ -42,13 +53,20 @@ PRINTER_ID = "usb://0x04f9:0x2015"  # QL-500 USB ID
 LABEL_PAPER_SPEC = "39x90"  # Die-cut label specification
 
 # Printer conversion settings
-PRINT_THRESHOLD = 70  # B&W conversion threshold (0-255): lower = more black
+PRINT_THRESHOLD = 70  # B&W conversion threshold (0-100): higher = more black
 PRINT_ROTATION = '0'  # Label rotation (0, 90, 180, 270 degrees)
 PRINT_DITHER = False  # Use dithering for image conversion
 PRINT_COMPRESSION = False  # Use compression in printer data
 PRINT_RED = False  # Use red printing (for compatible printers)
 PRINT_HIGH_DPI = False  # Use 600 DPI (instead of 300)
 PRINT_CUT = False  # Cut the label after printing
+# The pure-Python packbits compressor dominates conversion time when enabled,
+# so the uncompressed raster path is pinned here.
+assert PRINT_COMPRESSION is False
+# brother_ql treats the threshold as a percentage and applies it to the
+# inverted image; the highest luminance still printed black works out to:
+PRINT_CUTOFF = 255 - int((100 - PRINT_THRESHOLD) / 100 * 255)
+PRINT_LUT = [0] * (PRINT_CUTOFF + 1) + [255] * (255 - PRINT_CUTOFF)  # B&W threshold LUT
 selected_backend = guess_backend(PRINTER_ID)
 BACKEND_CLASS = backend_factory(selected_backend)['backend_class']
 
@@ -57,22 +75,55 @@ def main():
     participants = pd.read_csv(INPUT_DATA_PATH)
     participants.fillna("", inplace=True)
     participants.sort_values("T-shirt size", inplace=True)
-    qlr = BrotherQLRaster(PRINTER_MODEL)
     prep_preview_dir()
     preview_images = []
     blank_label_template = Image.new(LABEL_COLOUR_MODE, LABEL_SIZE, BACKGROUND_COLOUR)
-    logo = get_resized_logo()
-    for _, participant in participants.iterrows():
-        draw, label_img = make_label_with_logo(blank_label_template, logo)
-        add_name(draw, participant["Name"])
-        add_participant_category(draw, participant["Category"])
-        add_t_shirt_size(draw, participant["T-shirt size"])
-        if PREVIEW_MODE:
-            preview_image(label_img, participant["Name"])
-            preview_images.append(label_img)
-        else:
-            print_label(label_img, participant["Name"], qlr)
-    preview_grid(participants, preview_images)
+    base_label = make_base_label(blank_label_template, get_resized_logo())
+    base_bytes = base_label.tobytes("raw", "RGBX")
+    # Categories and sizes have low cardinality, so their tiles and fixed
+    # positions can be baked before the loop; per label they cost a dict
+    # lookup plus a paste.
+    category_tiles = make_category_tiles(participants["Category"].unique())
+    size_tiles = make_size_tiles(participants["T-shirt size"].unique())
+    label_fields = participants[["Name", "Category", "T-shirt size"]]
+    print_jobs = []
+    preview_save_jobs = []
+    label_cache = {}  # (name, category, size) -> rendered label
+    raster_cache = {}  # (name, category, size) -> printer instruction bytes
+    # One worker thread converts and sends label N while the main thread
+    # renders label N+1; each job builds its own BrotherQLRaster because
+    # raster state is not shareable between labels.
+    with ThreadPoolExecutor(max_workers=1) as print_executor:
+        for name, category, tshirt_size in label_fields.itertuples(index=False, name=None):
+            label_key = (name, category, tshirt_size)
+            label_img = label_cache.get(label_key)
+            newly_rendered = label_img is None
+            if newly_rendered:
+                # Preview images are shown and PNG-encoded, which needs a
+                # real RGB image; print labels go straight to 1-bit
+                # conversion, so they can render into a mapped RGBX buffer.
+                if PREVIEW_MODE:
+                    label_img = base_label.copy()
+                else:
+                    label_img = label_from_base_bytes(base_bytes)
+                add_name(label_img, name)
+                tile, position = category_tiles[category]
+                label_img.paste(tile, position, tile)
+                tile, position = size_tiles[tshirt_size]
+                label_img.paste(tile, position, tile)
+                label_cache[label_key] = label_img
+            if PREVIEW_MODE:
+                preview_image(label_img, name)
+                if SAVE_PREVIEWS and PREVIEW_SAVE_PATH and newly_rendered:
+                    preview_save_jobs.append(make_preview_save_job(label_img, name))
+                preview_images.append(label_img)
+            else:
+                print_jobs.append(print_executor.submit(
+                    print_label, label_img, name, label_key, raster_cache))
+    for job in print_jobs:
+        job.result()  # surface any conversion or printer errors
+    save_previews(preview_save_jobs)
+    preview_grid(preview_images)
 
 
 def prep_preview_dir():
@@ -82,85 +133,166 @@ def prep_preview_dir():
 
 def get_resized_logo():
     logo_print_size = (LABEL_SIZE[0] - 2 * PADDING, LABEL_SIZE[1] - 2 * PADDING)
+    cache_path = (
+        f".logo_cache_{int(os.path.getmtime(LOGO_IMAGE_PATH))}"
+        f"_{logo_print_size[0]}x{logo_print_size[1]}_c{PRINT_CUTOFF}.pkl"
+    )
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as cache_file:
+            return pickle.load(cache_file)
     logo_original = Image.open(LOGO_IMAGE_PATH).convert(LOGO_COLOUR_MODE)
     logo_original.thumbnail(logo_print_size)  # resize to fit
-    return logo_original
+    ink = logo_original.convert("L").point(
+        lambda p: 255 if p <= PRINT_CUTOFF else 0, mode="1")
+    opaque = logo_original.getchannel("A").point(
+        lambda p: 255 if p > 0 else 0, mode="1")
+    logo_mask = ImageChops.logical_and(ink, opaque)  # 1 bit/pixel: 255 where ink goes
+    with open(cache_path, "wb") as cache_file:
+        pickle.dump(logo_mask, cache_file)
+    return logo_mask
 
 
-def make_label_with_logo(blank_label_template, logo):
+def make_base_label(blank_label_template, logo_mask):
     logo_top_left_corner_coords = (PADDING, PADDING)
-    label_img = blank_label_template.copy()
-    draw = ImageDraw.Draw(label_img)
-    label_img.paste(logo, logo_top_left_corner_coords, logo)
-    return draw, label_img
+    base_label = blank_label_template.copy()
+    base_label.paste(PRINT_COLOUR, logo_top_left_corner_coords, logo_mask)
+    return base_label
+
+
+@functools.lru_cache(maxsize=TEXT_TILE_CACHE_SIZE)
+def _render_text_tile(text, font_key, fill):
+    font = FONTS[font_key]
+    # Single FreeType rasterization; the offset is where ImageDraw.text
+    # would place the ink relative to the anchor, so pastes must add it.
+    mask, offset = font.getmask2(text, mode="L")
+    width, height = mask.size
+    tile = Image.new("RGBA", (width, height), fill)
+    tile.putalpha(Image.frombytes("L", (width, height), bytes(mask)))
+    return tile, width, height, offset
 
-def add_name(draw, name):
-    width, _ = get_textsize(draw, name, LARGE_FONT)
+
+def add_name(label_img, name):
+    tile, width, _, offset = _render_text_tile(name, "large", PRINT_COLOUR)
     name_x = (LABEL_SIZE[0] - width) // 2
-    draw.text(
-        (name_x, NAME_VERTICAL_POSITION),
-        name,
-        fill=PRINT_COLOUR,
-        font=LARGE_FONT
-    )
+    label_img.paste(
+        tile, (name_x + offset[0], NAME_VERTICAL_POSITION + offset[1]), tile)
 
 
-def get_textsize(draw, text, font):
-    bbox = draw.textbbox((0, 0), text, font=font)
-    width = bbox[2] - bbox[0]
-    height = bbox[3] - bbox[1]
-    return width, height
+def label_from_base_bytes(base_bytes):
+    # frombuffer maps the bytearray directly as the pixel buffer (RGBX is
+    # Pillow's internal storage for RGB), so the label is assembled in place
+    # with a single bytearray copy and no Image allocation. Each label gets
+    # its own buffer because queued print jobs outlive the loop iteration.
+    buffer = bytearray(base_bytes)
+    label_img = Image.frombuffer(
+        LABEL_COLOUR_MODE, LABEL_SIZE, buffer, "raw", "RGBX", 0, 1)
+    label_img.readonly = 0  # draw through to the mapped buffer
+    return label_img
 
 
-def add_participant_category(draw, category_text):
-    _, height = get_textsize(draw, category_text, SMALL_FONT)
-    draw.text((PADDING, LABEL_SIZE[1] - height - BOTTOM_PADDING), category_text,
-              fill=PRINT_COLOUR, font=SMALL_FONT)
+def make_category_tiles(categories):
+    tiles = {}
+    for category in categories:
+        tile, _, height, offset = _render_text_tile(category, "small", PRINT_COLOUR)
+        tiles[category] = (
+            tile,
+            (PADDING + offset[0],
+             LABEL_SIZE[1] - height - BOTTOM_PADDING + offset[1])
+        )
+    return tiles
 
 
-def add_t_shirt_size(draw, tshirt_size):
-    width, height = get_textsize(draw, tshirt_size, SMALL_FONT)
-    draw.text(
-        (LABEL_SIZE[0] - width - PADDING, LABEL_SIZE[1] - height - BOTTOM_PADDING),
-        tshirt_size,
-        fill=PRINT_COLOUR,
-        font=SMALL_FONT
-    )
+def make_size_tiles(tshirt_sizes):
+    tiles = {}
+    for tshirt_size in tshirt_sizes:
+        tile, width, height, offset = _render_text_tile(
+            tshirt_size, "small", PRINT_COLOUR)
+        tiles[tshirt_size] = (
+            tile,
+            (LABEL_SIZE[0] - width - PADDING + offset[0],
+             LABEL_SIZE[1] - height - BOTTOM_PADDING + offset[1])
+        )
+    return tiles
 
 
-def print_label(label_img, name, qlr):
-    label_img = label_img.rotate(90, expand=True)
-    qlr = BrotherQLRaster(PRINTER_MODEL)
-    create_label(qlr, label_img, LABEL_PAPER_SPEC, threshold=70, cut=False, rotate=0)
+def print_label(label_img, name, label_key, raster_cache):
+    # Conversion is deterministic for identical labels, so duplicates reuse
+    # the cached instruction bytes and go straight to the printer. Only the
+    # single print worker thread touches the cache.
+    instructions = raster_cache.get(label_key)
+    if instructions is None:
+        # Threshold to 1 bit/pixel up front with a C-level LUT so
+        # brother_ql's per-pixel Python threshold loop has nothing left
+        # to do.
+        label_img = label_img.convert("L").point(PRINT_LUT, mode="1")
+        # transpose is a pure axis swap; rotate would go through the
+        # generic affine transform machinery for the same result.
+        label_img = label_img.transpose(Image.Transpose.ROTATE_90)
+        qlr = BrotherQLRaster(PRINTER_MODEL)
+        create_label(
+            qlr,
+            label_img,
+            LABEL_PAPER_SPEC,
+            threshold=PRINT_THRESHOLD,
+            cut=PRINT_CUT,
+            dither=PRINT_DITHER,
+            compress=PRINT_COMPRESSION,
+            red=PRINT_RED,
+            rotate=PRINT_ROTATION,
+            dpi_600=PRINT_HIGH_DPI,
+        )
+        instructions = qlr.data
+        raster_cache[label_key] = instructions
     be = BACKEND_CLASS(PRINTER_ID)
-    be.write(qlr.data)
+    be.write(instructions)
     be.dispose()
     print(f"Label printed: {name}")
 
 
 def preview_image(label_img, name):
-    if SAVE_PREVIEWS and PREVIEW_SAVE_PATH:
-        save_preview(label_img, name)
     if PREVIEW_METHOD == "pil":
         label_img.show(title=f"Label Preview: {name}")
 
 
-def save_preview(label_img, name):
-    name_slug = slugify(name)
+def make_preview_save_job(label_img, name):
+    return label_img.tobytes(), label_img.size, label_img.mode, slugify(name)
+
+
+def save_previews(preview_save_jobs):
+    # PNG encoding is the expensive part of saving previews and is
+    # embarrassingly parallel, so batch it across a process pool.
+    if not preview_save_jobs:
+        return
+    with multiprocessing.Pool() as pool:
+        for _ in pool.imap_unordered(_encode_png, preview_save_jobs):
+            pass
+
+
+def _encode_png(preview_save_job):
+    pixel_bytes, size, mode, name_slug = preview_save_job
+    label_img = Image.frombytes(mode, size, pixel_bytes)
     preview_filename = os.path.join(PREVIEW_SAVE_PATH, f"{name_slug}.png")
-    label_img.save(preview_filename)
+    # Low compression level: much faster zlib pass for slightly larger files.
+    label_img.save(preview_filename, optimize=False, compress_level=1)
 
 
-def preview_grid(participants, preview_images):
+def preview_grid(preview_images):
     if PREVIEW_MODE and PREVIEW_METHOD == "matplotlib" and preview_images:
-        num_images = len(preview_images)
-        cols = min(PREVIEW_COLUMNS, num_images)
-        rows = (num_images + cols - 1) // cols
+        # One imshow of a stitched mosaic instead of one Axes per label:
+        # matplotlib artist overhead stays constant as the list grows.
+        tiles = [np.asarray(img.reduce(PREVIEW_DOWNSCALE)) for img in preview_images]
+        cols = min(PREVIEW_COLUMNS, len(tiles))
+        rows = (len(tiles) + cols - 1) // cols
+        blank_tile = np.full_like(tiles[0], 255)
+        tiles.extend([blank_tile] * (rows * cols - len(tiles)))
+        mosaic = np.concatenate(
+            [np.concatenate(tiles[row * cols:(row + 1) * cols], axis=1)
+             for row in range(rows)],
+            axis=0
+        )
         plt.figure(figsize=(15, 5 * rows))
-        for i, img in enumerate(preview_images):
-            plt.subplot(rows, cols, i + 1)
-            plt.imshow(img)
-            plt.axis('off')
+        plt.imshow(mosaic)
+        plt.axis('off')
         plt.tight_layout()
         plt.show()
 